@@ -1,21 +1,59 @@
+import asyncio
 import base64
+import math
 import os
-from typing import Optional, Dict, Any, List
+import re
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple
 from io import BytesIO
-from PIL import Image
 
+import httpx
+import orjson
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, TypeAdapter
 from google import genai
 from langchain_core.prompts import ChatPromptTemplate
 
 try:
-    from google.genai.types import GenerateContentConfig, Modality  # type: ignore
+    from google.genai.types import (  # type: ignore
+        CreateCachedContentConfig,
+        GenerateContentConfig,
+        HttpOptions,
+        Modality,
+    )
 except ImportError:
+    CreateCachedContentConfig = None  # type: ignore
     GenerateContentConfig = None  # type: ignore
+    HttpOptions = None  # type: ignore
     Modality = None  # type: ignore
 
+try:
+    # Drop-in libuv event loop — lower per-request overhead than asyncio's
+    # default loop, which matters once every endpoint awaits Gemini.
+    import uvloop
+
+    uvloop.install()
+except ImportError:
+    pass
+
+try:
+    # SIMD-accelerated (SSSE3/AVX2/NEON) base64 — 3-10x faster than stdlib
+    # on the multi-hundred-KB image payloads this service moves around.
+    import pybase64
+
+    _b64encode_str = pybase64.b64encode_as_string
+    _b64decode = pybase64.b64decode
+except ImportError:
+    def _b64encode_str(data: bytes) -> str:
+        return base64.b64encode(data).decode()
+
+    _b64decode = base64.b64decode
+
 
 # -----------------------------
 # ENV & constants
@@ -26,6 +64,18 @@ if not GOOGLE_GENAI_API_KEY:
 
 GEMINI_IMAGE_MODEL = "gemini-2.5-flash-image"
 GEMINI_TEXT_MODEL = "gemini-2.5-flash"
+GEMINI_EMBEDDING_MODEL = "text-embedding-004"
+
+# Uploaded reference images are downscaled to this edge length before being
+# sent to Gemini — larger inputs only add decode time and upload bandwidth.
+IMAGE_INPUT_MAX_SIDE = 1024
+
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_MAX_SIZE = 256
+
+CONTEXT_CACHE_TTL_SECONDS = 3600
+
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
 
 ALLOWED_ORIGINS = [
     origin.strip()
@@ -40,50 +90,220 @@ ALLOWED_ORIGINS = [
 # -----------------------------
 # LangChain Setup with Gemini
 # -----------------------------
-genai_client = genai.Client(api_key=GOOGLE_GENAI_API_KEY)
+def _httpx_client_args(transport_cls) -> Dict[str, Any]:
+    """Keepalive + HTTP/2 transport settings shared by all Gemini calls.
+
+    Reusing one pooled connection avoids a TLS handshake per call, and
+    HTTP/2 lets the concurrent gathers multiplex on a single connection.
+    """
+    try:
+        transport = transport_cls(retries=2, http2=True)
+    except ImportError:  # h2 not installed; keepalive pooling still applies
+        transport = transport_cls(retries=2)
+    return {
+        "transport": transport,
+        "limits": httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        "timeout": 60,
+    }
+
+
+genai_client = genai.Client(
+    api_key=GOOGLE_GENAI_API_KEY,
+    http_options=HttpOptions(
+        client_args=_httpx_client_args(httpx.HTTPTransport),
+        async_client_args=_httpx_client_args(httpx.AsyncHTTPTransport),
+    ) if HttpOptions is not None else None,
+)
+
+# With gather fanning calls out per request, concurrent requests could open
+# an unbounded number of parallel Gemini calls and trip rate limits. The
+# semaphore turns that into queueing instead of 429 failures.
+_GEMINI_SEM = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+
+async def _gemini_call(method, **kwargs):
+    """Run a Gemini SDK call under the per-process concurrency cap.
+
+    429s are retried with exponential backoff (outside the semaphore, so a
+    waiting call is not holding a slot while it sleeps).
+    """
+    for attempt in range(3):
+        async with _GEMINI_SEM:
+            try:
+                return await method(**kwargs)
+            except Exception as e:
+                if getattr(e, "code", None) != 429 or attempt == 2:
+                    raise
+        await asyncio.sleep(2 ** attempt)
+
+
+# -----------------------------
+# Semantic cache
+# -----------------------------
+class SemanticCache:
+    """Embedding-similarity cache for Gemini text responses.
+
+    Layout and caption prompts are highly structured and repeat with only
+    minor wording changes across campaigns, so near-duplicate inputs can
+    reuse an earlier response instead of paying a fresh Gemini round-trip.
+    Entries are kept in-memory with LRU eviction; lookups return a hit when
+    cosine similarity against a stored input meets the threshold.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_size: int = SEMANTIC_CACHE_MAX_SIZE):
+        self.threshold = threshold
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[List[float], Any]]" = OrderedDict()
+
+    async def _embed(self, text: str) -> Optional[List[float]]:
+        try:
+            result = await _gemini_call(
+                genai_client.aio.models.embed_content,
+                model=GEMINI_EMBEDDING_MODEL, contents=text,
+            )
+            vec = list(result.embeddings[0].values)
+            norm = math.sqrt(sum(v * v for v in vec))
+            return [v / norm for v in vec] if norm else None
+        except Exception as e:
+            print(f"Semantic cache embedding failed: {e}")
+            return None
+
+    async def lookup(self, text: str) -> Tuple[Optional[Any], Optional[List[float]]]:
+        """Return (cached value or None, embedding) for the given input."""
+        vec = await self._embed(text)
+        if vec is None or not self._entries:
+            return None, vec
+        best_key, best_sim = None, 0.0
+        for key, (stored_vec, _) in self._entries.items():
+            sim = sum(a * b for a, b in zip(vec, stored_vec))
+            if sim > best_sim:
+                best_key, best_sim = key, sim
+        if best_key is not None and best_sim >= self.threshold:
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key][1], vec
+        return None, vec
+
+    def store(self, text: str, vec: Optional[List[float]], value: Any) -> None:
+        if vec is None:
+            return
+        self._entries[text] = (vec, value)
+        self._entries.move_to_end(text)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+_COLLATERAL_CACHE = SemanticCache()
+
+
+# -----------------------------
+# Gemini context caching
+# -----------------------------
+class GeminiContextCache:
+    """Server-side cache for a static system instruction.
+
+    The system portions of our prompts are identical on every call, so
+    registering them once with Gemini's context caching means only the small
+    dynamic user part is processed (and billed) at full rate per request.
+    The cache entry is created lazily and re-created shortly before its TTL
+    expires. If caching is unavailable (e.g. the instruction is below the
+    model's minimum cacheable size), calls fall back to sending the full
+    prompt inline.
+    """
+
+    def __init__(self, system_instruction: str,
+                 ttl_seconds: int = CONTEXT_CACHE_TTL_SECONDS):
+        self.system_instruction = system_instruction
+        self.ttl_seconds = ttl_seconds
+        self._name: Optional[str] = None
+        self._expires_at = 0.0
+        self._disabled = CreateCachedContentConfig is None
+        self._lock = asyncio.Lock()
+
+    async def name(self) -> Optional[str]:
+        """Return the cached-content name, refreshing it near expiry."""
+        if self._disabled:
+            return None
+        if self._name and time.monotonic() < self._expires_at - 60:
+            return self._name
+        async with self._lock:
+            if self._name and time.monotonic() < self._expires_at - 60:
+                return self._name
+            try:
+                cache = await genai_client.aio.caches.create(
+                    model=GEMINI_TEXT_MODEL,
+                    config=CreateCachedContentConfig(
+                        system_instruction=self.system_instruction,
+                        ttl=f"{self.ttl_seconds}s",
+                    ),
+                )
+                self._name = cache.name
+                self._expires_at = time.monotonic() + self.ttl_seconds
+            except Exception as e:
+                print(f"Context caching unavailable, sending full prompts: {e}")
+                self._disabled = True
+        return self._name
+
+
+async def _generate_text(cache: GeminiContextCache, user_text: str, **config_kwargs):
+    """Run a Gemini text call, using the cached system instruction if available.
+
+    Extra keyword arguments (e.g. response_mime_type, response_schema) are
+    forwarded to GenerateContentConfig.
+    """
+    cached_name = await cache.name()
+    if cached_name:
+        return await _gemini_call(
+            genai_client.aio.models.generate_content,
+            model=GEMINI_TEXT_MODEL,
+            contents=[{"role": "user", "parts": [{"text": user_text}]}],
+            config=GenerateContentConfig(cached_content=cached_name, **config_kwargs),
+        )
+    return await _gemini_call(
+        genai_client.aio.models.generate_content,
+        model=GEMINI_TEXT_MODEL,
+        contents=[{
+            "role": "user",
+            "parts": [{"text": f"{cache.system_instruction}\n\n{user_text}"}],
+        }],
+        config=GenerateContentConfig(**config_kwargs) if config_kwargs else None,
+    )
 
 
 # -----------------------------
 # PROMPT TEMPLATES
 # -----------------------------
-LAYOUT_PROMPT = ChatPromptTemplate.from_messages([
+COLLATERAL_PROMPT = ChatPromptTemplate.from_messages([
     ("system",
-     "You are an expert creative director designing printable layouts for healthcare campaigns in Singapore. "
-     "You must produce a structured JSON layout for use in a design editor like Canva or Fabric.js. "
-     "Positions must be given as percentages of the canvas (0-100) for responsive scaling. "
+     "You are an expert creative director and healthcare copywriter for SATA CommHealth campaigns in Singapore. "
+     "You design printable poster layouts for use in a design editor like Canva or Fabric.js, and you craft concise, "
+     "emotionally engaging poster text — clear, warm, and motivating, suitable for public awareness, preventive health, "
+     "and community care. Positions must be given as percentages of the canvas (0-100) for responsive scaling. "
      "Return ONLY valid JSON with no markdown formatting, no code blocks, and no explanatory text."),
     ("user",
      "Campaign Core Idea:\n{core_idea}\n"
-     "Target Audience:\n{audience}\n\n"
-     "Return only a **valid JSON** structure with coordinates for key visual elements:\n"
-     "`background_image`, `headline`, `tagline`, `cta_text`, and `logo_area`.\n"
-     "Each should have `x`, `y`, `width`, and `height` fields (percentages). Example:\n"
-     "{{\n"
-     "  \"background_image\": {{\"x\":0,\"y\":0,\"width\":100,\"height\":100}},\n"
-     "  \"headline\": {{\"x\":10,\"y\":70,\"width\":80,\"height\":10}},\n"
-     "  \"tagline\": {{\"x\":10,\"y\":82,\"width\":80,\"height\":5}},\n"
-     "  \"cta_text\": {{\"x\":10,\"y\":88,\"width\":30,\"height\":5}},\n"
-     "  \"logo_area\": {{\"x\":75,\"y\":5,\"width\":20,\"height\":10}}\n"
-     "}}\n\n"
-     "Ensure the proportions visually balance the elements for a general healthcare poster.")
-])
-
-CAPTION_PROMPT = ChatPromptTemplate.from_messages([
-    ("system",
-     "You are a healthcare copywriter crafting concise, emotionally engaging poster text for SATA CommHealth campaigns. "
-     "Your writing style should be clear, warm, and motivating — suitable for public awareness, preventive health, and community care. "
-     "Return ONLY valid JSON — no markdown, code blocks, or explanations."),
-    ("user",
-     "Core Idea:\n{core_idea}\n"
      "Target Audience:\n{audience}\n"
      "Tone & Style:\n{writing_style}\n\n"
-     "Generate a short, natural-language caption set in JSON format:\n"
+     "Return one **valid JSON** object with two top-level keys, `layout` and `captions`. Example:\n"
      "{{\n"
-     "  \"headline\": \"...\",\n"
-     "  \"tagline\": \"...\",\n"
-     "  \"cta\": \"...\"\n"
+     "  \"layout\": {{\n"
+     "    \"background_image\": {{\"x\":0,\"y\":0,\"width\":100,\"height\":100}},\n"
+     "    \"headline\": {{\"x\":10,\"y\":70,\"width\":80,\"height\":10}},\n"
+     "    \"tagline\": {{\"x\":10,\"y\":82,\"width\":80,\"height\":5}},\n"
+     "    \"cta_text\": {{\"x\":10,\"y\":88,\"width\":30,\"height\":5}},\n"
+     "    \"logo_area\": {{\"x\":75,\"y\":5,\"width\":20,\"height\":10}}\n"
+     "  }},\n"
+     "  \"captions\": {{\n"
+     "    \"headline\": \"...\",\n"
+     "    \"tagline\": \"...\",\n"
+     "    \"cta\": \"...\"\n"
+     "  }}\n"
      "}}\n\n"
-     "Rules:\n"
+     "Layout rules:\n"
+     "- Include `background_image`, `headline`, `tagline`, `cta_text`, and `logo_area`, "
+     "each with `x`, `y`, `width`, and `height` fields (percentages).\n"
+     "- Ensure the proportions visually balance the elements for a general healthcare poster.\n\n"
+     "Caption rules:\n"
      "- Keep the headline under 8 words.\n"
      "- Make the tagline supportive and empathetic.\n"
      "- Keep the CTA direct, community-oriented, and free of jargon.")
@@ -111,11 +331,50 @@ Overall Theme:
 Reflect SATA CommHealth’s values — trusted community healthcare that’s “close to your heart.”
 """
 
+REFINE_LAYOUT_SYSTEM = (
+    "You are refining a structured JSON layout for a healthcare campaign poster. "
+    "Return ONLY valid JSON with no markdown formatting, code blocks, or explanatory text."
+)
+
+REFINE_CAPTION_SYSTEM = (
+    "You are refining poster captions for a SATA CommHealth healthcare campaign. "
+    "Return ONLY valid JSON with no markdown formatting, code blocks, or explanatory text."
+)
+
+_COLLATERAL_CONTEXT = GeminiContextCache(COLLATERAL_PROMPT.messages[0].prompt.template)
+_REFINE_LAYOUT_CONTEXT = GeminiContextCache(REFINE_LAYOUT_SYSTEM)
+_REFINE_CAPTION_CONTEXT = GeminiContextCache(REFINE_CAPTION_SYSTEM)
+
+# Raw user-message template, resolved once so per-request rendering is a
+# plain str.format instead of LangChain message construction.
+_COLLATERAL_USER_TEMPLATE = COLLATERAL_PROMPT.messages[1].prompt.template
+
+
+@lru_cache(maxsize=512)
+def _render_collateral_prompt(core_idea: str, audience: Optional[str],
+                              writing_style: Optional[str]) -> str:
+    return _COLLATERAL_USER_TEMPLATE.format(
+        core_idea=core_idea, audience=audience, writing_style=writing_style
+    )
+
+
+@lru_cache(maxsize=1024)
+def _render_direct_prompt(core_idea: str, audience: Optional[str], with_ref: bool) -> str:
+    prompt = DIRECT_IMAGE_PROMPT.format(core_idea=core_idea, audience=audience).strip()
+    if with_ref:
+        prompt = f"Use the provided reference image as visual inspiration.\n\n{prompt}"
+    return prompt
+
 
 # -----------------------------
 # FastAPI Setup
 # -----------------------------
-app = FastAPI(title="SATA CommHealth Canva-AI Generator v3")
+app = FastAPI(
+    title="SATA CommHealth Canva-AI Generator v3",
+    # orjson serializes the large base64 image payloads at a fraction of the
+    # stdlib encoder's cost.
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -125,6 +384,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Base64 image payloads compress to roughly three quarters of their size;
+# small responses are left alone.
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 from fastapi import APIRouter
 api_router = APIRouter(prefix="")
 
@@ -159,92 +422,254 @@ class CanvaAIResponse(BaseModel):
     images_b64: List[str]
 
 
+# Structured-output schema for the combined layout + captions call.
+class LayoutBox(BaseModel):
+    x: float
+    y: float
+    width: float
+    height: float
+
+
+class LayoutSchema(BaseModel):
+    background_image: LayoutBox
+    headline: LayoutBox
+    tagline: LayoutBox
+    cta_text: LayoutBox
+    logo_area: LayoutBox
+
+
+class CaptionsSchema(BaseModel):
+    headline: str
+    tagline: str
+    cta: str
+
+
+class LayoutCaptions(BaseModel):
+    layout: LayoutSchema
+    captions: CaptionsSchema
+
+
+_RESPONSE_ADAPTER = TypeAdapter(CanvaAIResponse)
+
+
+def _collateral_response(layout: Dict[str, Any], captions: Dict[str, str],
+                         visual_prompt: str, images: List[str]) -> Response:
+    """Serialize a CanvaAIResponse without re-validating it.
+
+    The server builds this object itself, so FastAPI's response_model
+    validation — which would re-scan every base64 image string — is pure
+    overhead. model_construct skips field validation and the shared
+    TypeAdapter dumps straight to JSON bytes.
+    """
+    body = _RESPONSE_ADAPTER.dump_json(CanvaAIResponse.model_construct(
+        layout_json=layout,
+        captions=captions,
+        visual_prompt=visual_prompt,
+        images_b64=images,
+    ))
+    return Response(content=body, media_type="application/json")
+
+
 # -----------------------------
 # Helper Functions
 # -----------------------------
-def _generate_layout(payload: CanvaAIRequest) -> Dict[str, Any]:
-    layout_prompt = LAYOUT_PROMPT.invoke({
-        "core_idea": payload.core_idea,
-        "audience": payload.audience,
-    })
-    response = genai_client.models.generate_content(
-        model=GEMINI_TEXT_MODEL,
-        contents=[{"role": "user", "parts": [{"text": layout_prompt.to_string()}]}],
-    )
-    import json, re
+_JSON_BLOCK_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def _parse_json_block(text: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Extract and parse the first JSON object embedded in a model response."""
+    if not text:
+        return None
+    match = _JSON_BLOCK_RE.search(text)
+    if not match:
+        return None
     try:
-        text = response.text.strip()
-        json_match = re.search(r'\{.*\}', text, re.DOTALL)
-        if json_match:
-            return json.loads(json_match.group(0))
-    except Exception as e:
-        print(f"Layout JSON parsing error: {e}")
-    return {
-        "background_image": {"x": 0, "y": 0, "width": 100, "height": 100},
-        "headline": {"x": 10, "y": 70, "width": 80, "height": 10},
-        "tagline": {"x": 10, "y": 82, "width": 80, "height": 5},
-        "cta_text": {"x": 10, "y": 88, "width": 30, "height": 5},
-        "logo_area": {"x": 75, "y": 5, "width": 20, "height": 10},
-    }
+        return orjson.loads(match.group(0))
+    except orjson.JSONDecodeError as e:
+        print(f"JSON parsing error: {e}")
+        return None
+
+
+# Attribute paths where Gemini responses may carry image payloads; "*" means
+# iterate the value at that position.
+_IMAGE_PATHS = (
+    ("image", "data"),
+    ("images", "*", "data"),
+    ("candidates", "*", "content", "parts", "*", "inline_data", "data"),
+)
 
 
-def _generate_captions(payload: CanvaAIRequest) -> Dict[str, str]:
-    caption_prompt = CAPTION_PROMPT.invoke({
-        "core_idea": payload.core_idea,
-        "audience": payload.audience,
-        "writing_style": payload.writing_style,
+def _walk(obj: Any, path: Tuple[str, ...]):
+    """Yield every value reachable from obj along path."""
+    if obj is None:
+        return
+    if not path:
+        yield obj
+        return
+    head, rest = path[0], path[1:]
+    if head == "*":
+        try:
+            items = iter(obj)
+        except TypeError:
+            return
+        for item in items:
+            yield from _walk(item, rest)
+    else:
+        yield from _walk(getattr(obj, head, None), rest)
+
+
+Image = None  # populated on first use by _pil_image()
+
+
+def _pil_image():
+    """Import PIL on first use.
+
+    Only the image-refinement path needs it, and the import costs tens of
+    milliseconds plus several MB of RSS — noticeable on serverless cold
+    starts that never touch refinement.
+    """
+    global Image
+    if Image is None:
+        from PIL import Image as _Image
+        Image = _Image
+    return Image
+
+
+def _decode_image_b64(image_b64: str, max_side: int = IMAGE_INPUT_MAX_SIDE) -> "Image.Image":
+    """Decode a base64 image and downscale it for upload to Gemini.
+
+    Image.draft lets libjpeg scale JPEGs in the DCT domain during decode, so
+    multi-megapixel uploads never materialize at full resolution; thumbnail
+    then caps the final size for all formats.
+    """
+    img = _pil_image().open(BytesIO(_b64decode(image_b64)))
+    img.draft("RGB", (max_side, max_side))
+    img.thumbnail((max_side, max_side))
+    return img
+
+
+_MULTIPART_BOUNDARY = "sata-collateral"
+
+
+def _multipart_collateral_response(layout: Dict[str, Any], captions: Dict[str, str],
+                                   visual_prompt: str, images_b64: List[str]) -> Response:
+    """Pack collateral as multipart/mixed: JSON metadata plus raw image parts.
+
+    Sending the image bytes as binary parts avoids the ~33% base64 inflation
+    of the JSON response and the matching decode on the client.
+    """
+    boundary = _MULTIPART_BOUNDARY.encode()
+    meta = orjson.dumps({
+        "layout_json": layout,
+        "captions": captions,
+        "visual_prompt": visual_prompt,
+        "image_count": len([img for img in images_b64 if img]),
     })
-    response = genai_client.models.generate_content(
-        model=GEMINI_TEXT_MODEL,
-        contents=[{"role": "user", "parts": [{"text": caption_prompt.to_string()}]}],
+    chunks = [b"--%s\r\nContent-Type: application/json\r\n\r\n%s\r\n" % (boundary, meta)]
+    for img_b64 in images_b64:
+        if not img_b64:
+            continue
+        chunks.append(
+            b"--%s\r\nContent-Type: image/png\r\n\r\n%s\r\n"
+            % (boundary, _b64decode(img_b64))
+        )
+    chunks.append(b"--%s--\r\n" % boundary)
+    return Response(
+        content=b"".join(chunks),
+        media_type=f"multipart/mixed; boundary={_MULTIPART_BOUNDARY}",
     )
-    import json, re
-    try:
-        text = response.text.strip()
-        json_match = re.search(r'\{.*\}', text, re.DOTALL)
-        if json_match:
-            return json.loads(json_match.group(0))
-    except Exception:
-        pass
-    return {
-        "headline": "Take Control of Your Health",
-        "tagline": "Early detection saves lives",
-        "cta": "Book Your Free Screening Today",
-    }
 
 
-def _generate_images_direct(payload: CanvaAIRequest) -> tuple[str, List[str]]:
-    direct_prompt = DIRECT_IMAGE_PROMPT.format(
-        core_idea=payload.core_idea, audience=payload.audience
+def _extract_images_b64(response: Any) -> List[str]:
+    """Collect every image payload in a Gemini response as base64 strings."""
+    images: List[str] = []
+    for path in _IMAGE_PATHS:
+        for data in _walk(response, path):
+            if isinstance(data, bytes):
+                images.append(_b64encode_str(data))
+            elif isinstance(data, str) and data:
+                images.append(data)
+        if images:
+            break
+    return images
+
+DEFAULT_LAYOUT: Dict[str, Any] = {
+    "background_image": {"x": 0, "y": 0, "width": 100, "height": 100},
+    "headline": {"x": 10, "y": 70, "width": 80, "height": 10},
+    "tagline": {"x": 10, "y": 82, "width": 80, "height": 5},
+    "cta_text": {"x": 10, "y": 88, "width": 30, "height": 5},
+    "logo_area": {"x": 75, "y": 5, "width": 20, "height": 10},
+}
+
+DEFAULT_CAPTIONS: Dict[str, str] = {
+    "headline": "Take Control of Your Health",
+    "tagline": "Early detection saves lives",
+    "cta": "Book Your Free Screening Today",
+}
+
+
+async def _generate_layout_captions(
+    payload: CanvaAIRequest,
+) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """Generate layout and captions in one structured-output Gemini call.
+
+    The two pieces share a system prompt and are produced together, halving
+    the text-call round-trips. JSON mode with a response schema means the
+    SDK hands back a validated LayoutCaptions; the regex fallback only runs
+    if the parsed object is missing.
+    """
+    cache_key = f"{payload.core_idea}\n{payload.audience}\n{payload.writing_style}"
+    cached, cache_vec = await _COLLATERAL_CACHE.lookup(cache_key)
+    if cached is not None:
+        return cached
+
+    prompt = _render_collateral_prompt(
+        payload.core_idea, payload.audience, payload.writing_style
+    )
+    response = await _generate_text(
+        _COLLATERAL_CONTEXT,
+        prompt,
+        response_mime_type="application/json",
+        response_schema=LayoutCaptions,
+    )
+
+    parsed = getattr(response, "parsed", None)
+    if isinstance(parsed, LayoutCaptions):
+        result = (parsed.layout.model_dump(), parsed.captions.model_dump())
+        _COLLATERAL_CACHE.store(cache_key, cache_vec, result)
+        return result
+
+    data = _parse_json_block(response.text)
+    if data and isinstance(data.get("layout"), dict) and isinstance(data.get("captions"), dict):
+        result = (data["layout"], data["captions"])
+        _COLLATERAL_CACHE.store(cache_key, cache_vec, result)
+        return result
+    return DEFAULT_LAYOUT, DEFAULT_CAPTIONS
+
+
+async def _generate_images_direct(payload: CanvaAIRequest) -> tuple[str, List[str]]:
+    direct_prompt = _render_direct_prompt(
+        payload.core_idea, payload.audience, bool(payload.sample_image_b64)
     )
-    if payload.sample_image_b64:
-        direct_prompt = f"Use the provided reference image as visual inspiration.\n\n{direct_prompt}"
 
     parts = []
     if payload.sample_image_b64:
         parts.append({"inline_data": {"mime_type": "image/jpeg", "data": payload.sample_image_b64}})
     parts.append({"text": direct_prompt})
 
-    response = genai_client.models.generate_content(
-        model=GEMINI_IMAGE_MODEL, contents=[{"role": "user", "parts": parts}]
+    response = await _gemini_call(
+        genai_client.aio.models.generate_content,
+        model=GEMINI_IMAGE_MODEL, contents=[{"role": "user", "parts": parts}],
     )
 
-    images = []
-    if hasattr(response, "candidates"):
-        for c in response.candidates:
-            for p in getattr(c.content, "parts", []):
-                if getattr(p, "inline_data", None):
-                    data = p.inline_data.data
-                    if isinstance(data, bytes):
-                        images.append(base64.b64encode(data).decode())
-                    elif data:
-                        images.append(data)
+    # Encoding several hundred KB of image data is CPU work — off the loop.
+    images = await asyncio.to_thread(_extract_images_b64, response)
     if not images:
         images.append("")
-    return direct_prompt.strip(), images
+    return direct_prompt, images
 
 
-def _refine_layout(req: RefinementRequest) -> Dict[str, Any]:
+async def _refine_layout(req: RefinementRequest) -> Dict[str, Any]:
     context = f"""
 You previously generated this layout:
 {req.current_layout}
@@ -254,21 +679,12 @@ User wants refinement:
 
 Return updated layout JSON.
 """
-    response = genai_client.models.generate_content(
-        model=GEMINI_TEXT_MODEL, contents=[{"role": "user", "parts": [{"text": context}]}]
-    )
-    import json, re
-    try:
-        text = response.text.strip()
-        json_match = re.search(r'\{.*\}', text, re.DOTALL)
-        if json_match:
-            return json.loads(json_match.group(0))
-    except Exception:
-        pass
-    return req.current_layout or {}
+    response = await _generate_text(_REFINE_LAYOUT_CONTEXT, context)
+    layout = _parse_json_block(response.text)
+    return layout if layout is not None else (req.current_layout or {})
 
 
-def _refine_captions(req: RefinementRequest) -> Dict[str, str]:
+async def _refine_captions(req: RefinementRequest) -> Dict[str, str]:
     context = f"""
 You previously generated these captions:
 {req.current_captions}
@@ -278,21 +694,12 @@ User wants refinement:
 
 Return new captions JSON.
 """
-    response = genai_client.models.generate_content(
-        model=GEMINI_TEXT_MODEL, contents=[{"role": "user", "parts": [{"text": context}]}]
-    )
-    import json, re
-    try:
-        text = response.text.strip()
-        json_match = re.search(r'\{.*\}', text, re.DOTALL)
-        if json_match:
-            return json.loads(json_match.group(0))
-    except Exception:
-        pass
-    return req.current_captions or {}
+    response = await _generate_text(_REFINE_CAPTION_CONTEXT, context)
+    captions = _parse_json_block(response.text)
+    return captions if captions is not None else (req.current_captions or {})
 
 
-def _refine_images(req: RefinementRequest) -> tuple[str, List[str]]:
+async def _refine_images(req: RefinementRequest) -> tuple[str, List[str]]:
     """Refine campaign image, optionally using a reference image for guidance."""
     if not req.sample_image_b64:
         return "No base campaign image provided", [""]
@@ -309,33 +716,27 @@ lighting, and overall realism of the original.
 """
 
     try:
-        base_img = Image.open(BytesIO(base64.b64decode(req.sample_image_b64)))
+        # PIL decoding is CPU-bound — keep it off the event loop.
+        base_img = await asyncio.to_thread(_decode_image_b64, req.sample_image_b64)
         contents = [base_img]
 
         if req.reference_image_b64:
             try:
-                ref_img = Image.open(BytesIO(base64.b64decode(req.reference_image_b64)))
+                ref_img = await asyncio.to_thread(_decode_image_b64, req.reference_image_b64)
                 contents.append(ref_img)
             except Exception as e:
                 print(f"⚠️ Reference image decode failed: {e}")
 
         contents.append(refinement_prompt)
 
-        response = genai_client.models.generate_content(
+        response = await _gemini_call(
+            genai_client.aio.models.generate_content,
             model=GEMINI_IMAGE_MODEL,
             contents=contents,
             config=GenerateContentConfig(response_modalities=[Modality.TEXT, Modality.IMAGE]),
         )
 
-        images = []
-        for part in response.candidates[0].content.parts:
-            if getattr(part, "inline_data", None):
-                data = part.inline_data.data
-                if isinstance(data, bytes):
-                    images.append(base64.b64encode(data).decode())
-                else:
-                    images.append(data)
-
+        images = await asyncio.to_thread(_extract_images_b64, response)
         if not images:
             images.append("")
 
@@ -349,22 +750,47 @@ lighting, and overall realism of the original.
 # -----------------------------
 # Endpoints
 # -----------------------------
-@api_router.post("/create-collateral", response_model=CanvaAIResponse)
-def create_collateral(payload: CanvaAIRequest):
-    """Generate layout, captions, and one image."""
+@api_router.post("/create-collateral", response_model=None)
+async def create_collateral(payload: CanvaAIRequest, format: str = "json"):
+    """Generate layout, captions, and one image. The combined text call and
+    the image call are independent, so they run concurrently.
+
+    Pass `?format=multipart` to receive JSON metadata plus raw image bytes
+    as multipart/mixed instead of base64-in-JSON.
+    """
     try:
-        layout = _generate_layout(payload)
-        captions = _generate_captions(payload)
-        visual_prompt, images = _generate_images_direct(payload)
-        return CanvaAIResponse(
-            layout_json=layout, captions=captions, visual_prompt=visual_prompt, images_b64=images
+        (layout, captions), (visual_prompt, images) = await asyncio.gather(
+            _generate_layout_captions(payload),
+            _generate_images_direct(payload),
         )
+        if format == "multipart":
+            return await asyncio.to_thread(
+                _multipart_collateral_response, layout, captions, visual_prompt, images
+            )
+        return _collateral_response(layout, captions, visual_prompt, images)
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Collateral generation failed: {exc}")
 
 
-@api_router.post("/refine-collateral", response_model=CanvaAIResponse)
-def refine_collateral(req: RefinementRequest):
+@api_router.post("/create-collateral/raw")
+async def create_collateral_raw(payload: CanvaAIRequest):
+    """Generate one campaign image and stream the raw PNG bytes back.
+
+    Skips the base64-in-JSON round-trip entirely for clients that only
+    want the image.
+    """
+    try:
+        _, images = await _generate_images_direct(payload)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Image generation failed: {exc}")
+    if not images or not images[0]:
+        raise HTTPException(status_code=502, detail="Image generation returned no image.")
+    img_bytes = await asyncio.to_thread(_b64decode, images[0])
+    return StreamingResponse(BytesIO(img_bytes), media_type="image/png")
+
+
+@api_router.post("/refine-collateral", response_model=None)
+async def refine_collateral(req: RefinementRequest):
     """Refine layout, captions, images, or all — supports optional reference image."""
     try:
         layout = req.current_layout or {}
@@ -372,16 +798,20 @@ def refine_collateral(req: RefinementRequest):
         visual_prompt = req.current_visual_prompt or ""
         images = []
 
-        if req.element_type in ["layout", "all"]:
-            layout = _refine_layout(req)
-        if req.element_type in ["captions", "all"]:
-            captions = _refine_captions(req)
-        if req.element_type in ["images", "all"]:
-            visual_prompt, images = _refine_images(req)
-
-        return CanvaAIResponse(
-            layout_json=layout, captions=captions, visual_prompt=visual_prompt, images_b64=images
-        )
+        if req.element_type == "all":
+            layout, captions, (visual_prompt, images) = await asyncio.gather(
+                _refine_layout(req),
+                _refine_captions(req),
+                _refine_images(req),
+            )
+        elif req.element_type == "layout":
+            layout = await _refine_layout(req)
+        elif req.element_type == "captions":
+            captions = await _refine_captions(req)
+        elif req.element_type == "images":
+            visual_prompt, images = await _refine_images(req)
+
+        return _collateral_response(layout, captions, visual_prompt, images)
 
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Refinement failed: {exc}")